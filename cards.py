@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Card rendering for the HR ID Generator.
+
+Kept out of the Streamlit script so the process pool can pickle these
+functions by reference (`cards.build_cards`) under any start method.
+"""
+
+import io, zipfile, queue, threading
+from functools import lru_cache
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Arabic text handling
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+# Optional: libjpeg-turbo decoder for JPEG photos (falls back to OpenCV)
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TJ = TurboJPEG()
+except Exception:
+    _TJ = None
+
+# ===================== CONFIG =====================
+PHOTO_POS = (111, 168)
+PHOTO_SIZE = (300, 300)
+BARCODE_POS = (570, 465)
+BARCODE_SIZE = (390, 120)
+
+PHOTO_EXT_PRIORITY = (".png", ".jpg", ".jpeg", ".bmp")
+PHOTO_PREFETCH = 8  # decoded photos buffered ahead of the drawing loop
+
+FONT_CANDIDATES = [
+    "Amiri-Regular.ttf", "NotoNaskhArabic-Regular.ttf",
+    "Arial.ttf", "Tahoma.ttf"
+]
+BOLD_FONT_CANDIDATES = ["Amiri-Bold.ttf", "NotoNaskhArabic-Bold.ttf"]
+
+# Field order of the plain tuples handed to build_card
+CARD_FIELDS = ["name", "name_prepared", "job_prepared", "num", "nid", "photo"]
+
+# Code128 symbol widths (bar, space, bar, ...) for values 0-106; 106 is the stop symbol
+CODE128_PATTERNS = [
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312",
+    "132212", "221213", "221312", "231212", "112232", "122132", "122231", "113222",
+    "123122", "123221", "223211", "221132", "221231", "213212", "223112", "312131",
+    "311222", "321122", "321221", "312212", "322112", "322211", "212123", "212321",
+    "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121",
+    "313121", "211331", "231131", "213113", "213311", "213131", "311123", "311321",
+    "331121", "312113", "312311", "332111", "314111", "221411", "431111", "111224",
+    "111422", "121124", "121421", "141122", "141221", "112214", "112412", "122114",
+    "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112",
+    "421211", "212141", "214121", "412121", "111143", "111341", "131141", "114113",
+    "114311", "411113", "411311", "113141", "114131", "311141", "411131", "211412",
+    "211214", "211232", "2331112",
+]
+CODE128_CODE_B, CODE128_START_B, CODE128_START_C, CODE128_STOP = 100, 104, 105, 106
+CODE128_QUIET = 10  # quiet-zone modules on each side
+
+NAME_OFFSET_X = -40
+NAME_OFFSET_Y = -20
+BASE_NAME_XY = (915, 240)
+NAME_XY = (BASE_NAME_XY[0] + NAME_OFFSET_X, BASE_NAME_XY[1] + NAME_OFFSET_Y)
+JOB_ID_LABEL = "الرقم الوظيفي: "
+
+# ================== Helpers =======================
+def load_font(data, size: int, candidates=FONT_CANDIDATES):
+    """Load a font from raw bytes or the first loadable candidate (None if none)."""
+    if data is not None:
+        try:
+            return ImageFont.truetype(io.BytesIO(data), size)
+        except Exception:
+            pass
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except Exception:
+            continue
+    return None
+
+@lru_cache(maxsize=4096)
+def prepare_text(text: str) -> str:
+    """Arabic reshape + bidi."""
+    if not text:
+        return ""
+    reshaped = arabic_reshaper.reshape(str(text))
+    return get_display(reshaped)
+
+@lru_cache(maxsize=4096)
+def text_bbox(text: str, font) -> tuple:
+    """font.getbbox, memoized per (text, font)."""
+    return font.getbbox(text)
+
+def draw_aligned_text(draw, xy, text, font, fill="black", anchor="rt"):
+    """Draw right-to-left aligned text."""
+    if not text:
+        return
+    draw.text(xy, text, font=font, fill=fill, anchor=anchor)
+
+def draw_bold_text(draw, xy, text, font, fill="black", anchor="rt", bold_font=None):
+    """Single draw with a real bold face if given, else fake bold from one rasterization.
+
+    The fake bold matches drawing the text at (0,0), (1,0), (0,1), (1,1) offsets:
+    the text mask is laid out once and combined with its 1 px right/down
+    shifts the way four stacked draws composite.
+    """
+    if bold_font is not None:
+        draw_aligned_text(draw, xy, text, bold_font, fill, anchor)
+        return
+    if not text:
+        return
+    left, top, right, bottom = draw.textbbox(xy, text, font=font, anchor=anchor)
+    mask = Image.new("L", (right - left + 1, bottom - top + 1), 0)  # +1 px for the shifts
+    ImageDraw.Draw(mask).text((xy[0] - left, xy[1] - top), text, font=font, fill=255, anchor=anchor)
+    clear = 1.0 - np.asarray(mask, np.float32) / 255
+    clear[:, 1:] = clear[:, 1:] * clear[:, :-1]
+    clear[1:, :] = clear[1:, :] * clear[:-1, :]
+    draw.bitmap((left, top), Image.fromarray(((1.0 - clear) * 255 + 0.5).astype(np.uint8)), fill=fill)
+
+def photo_key(filename: str) -> str:
+    """Lookup key for a photo: lower-cased file stem."""
+    return Path(filename).stem.lower()
+
+def build_photo_index(zf: zipfile.ZipFile, wanted: set) -> dict:
+    """Map photo_key -> photo bytes for the wanted keys only, preferring PNG > JPG > JPEG > BMP."""
+    def rank(name):
+        ext = Path(name).suffix.lower()
+        return PHOTO_EXT_PRIORITY.index(ext) if ext in PHOTO_EXT_PRIORITY else len(PHOTO_EXT_PRIORITY)
+
+    chosen = {}
+    for zi in zf.infolist():
+        if zi.is_dir():
+            continue
+        stem = photo_key(zi.filename)
+        if stem not in wanted:
+            continue
+        if stem not in chosen or rank(zi.filename) < rank(chosen[stem].filename):
+            chosen[stem] = zi
+    return {stem: zf.read(zi) for stem, zi in chosen.items()}
+
+def decode_jpeg_rgb(data: bytes) -> np.ndarray:
+    """Decode a JPEG to RGB with libjpeg-turbo, scaling down in the IDCT while still covering PHOTO_SIZE."""
+    width, height = _TJ.decode_header(data)[:2]
+    scale = (1, 1)
+    for num, denom in _TJ.scaling_factors:
+        if (num / denom < scale[0] / scale[1]
+                and width * num / denom >= PHOTO_SIZE[0]
+                and height * num / denom >= PHOTO_SIZE[1]):
+            scale = (num, denom)
+    return _TJ.decode(data, pixel_format=TJPF_RGB, scaling_factor=scale)
+
+def jpeg_orientation(data: bytes) -> int:
+    """EXIF orientation tag (1 = upright), read from the header only."""
+    try:
+        return Image.open(io.BytesIO(data)).getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+def load_photo_rgb(data: bytes) -> np.ndarray:
+    """Decode, resize to PHOTO_SIZE and convert to RGB (libjpeg-turbo for JPEGs, else OpenCV)."""
+    # libjpeg-turbo ignores EXIF orientation; leave rotated photos to OpenCV, which applies it.
+    if _TJ is not None and data[:3] == b"\xff\xd8\xff" and jpeg_orientation(data) == 1:
+        try:
+            return cv2.resize(decode_jpeg_rgb(data), PHOTO_SIZE, interpolation=cv2.INTER_AREA)
+        except Exception:
+            pass  # e.g. CMYK JPEGs; let OpenCV try
+    bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError("unsupported or corrupt image")
+    resized = cv2.resize(bgr, PHOTO_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+
+def code128_values(text: str) -> list:
+    """Code128 symbol values for text (start, data, checksum, stop).
+
+    Digit strings use Code C pairs (a trailing odd digit switches to Code B);
+    anything else is Code B, which covers printable ASCII.
+    """
+    if text.isascii() and text.isdigit():
+        values = [CODE128_START_C] + [int(text[i:i + 2]) for i in range(0, len(text) - 1, 2)]
+        if len(text) % 2:
+            values += [CODE128_CODE_B, ord(text[-1]) - 32]
+    else:
+        bad = [c for c in text if not 32 <= ord(c) <= 126]
+        if bad:
+            raise ValueError(f"unsupported character for Code128: {bad[0]!r}")
+        values = [CODE128_START_B] + [ord(c) - 32 for c in text]
+    checksum = (values[0] + sum(i * v for i, v in enumerate(values[1:], 1))) % 103
+    return values + [checksum, CODE128_STOP]
+
+@lru_cache(maxsize=256)
+def render_barcode(national_id: str) -> Image.Image:
+    """Code128 drawn directly as a BARCODE_SIZE RGB image (whole pixels per module).
+
+    Cached: callers must only paste from the result, never draw on it.
+    """
+    widths = [int(w) for v in code128_values(national_id) for w in CODE128_PATTERNS[v]]
+    # Elements alternate bar/space starting with a bar (every symbol but stop has 6)
+    modules = np.repeat(np.arange(len(widths)) % 2 * 255, widths).astype(np.uint8)
+    module_px = max(1, BARCODE_SIZE[0] // (len(modules) + 2 * CODE128_QUIET))
+    row = np.repeat(modules, module_px)
+    pad = BARCODE_SIZE[0] - len(row)
+    if pad > 0:
+        row = np.pad(row, (pad // 2, pad - pad // 2), constant_values=255)
+    bars = Image.fromarray(np.tile(row, (BARCODE_SIZE[1], 1))).convert("RGB")
+    if bars.size != BARCODE_SIZE:  # too long for whole-pixel modules
+        bars = bars.resize(BARCODE_SIZE, Image.NEAREST)
+    return bars
+
+# ============ Card rendering (worker processes) ============
+_worker = {}
+
+def init_worker(template: Image.Image, font_bytes_ar, font_bytes_ar_bold):
+    """Per-process setup: keep the template, a reusable card canvas and fonts."""
+    _worker["template"] = template
+    _worker["card"] = template.copy()
+    _worker["draw"] = ImageDraw.Draw(_worker["card"])
+    _worker["font_ar"] = load_font(font_bytes_ar, 36) or ImageFont.load_default()
+    # Only fall back to a bundled bold face when the regular one is bundled too.
+    bold_candidates = BOLD_FONT_CANDIDATES if font_bytes_ar is None else []
+    _worker["font_ar_bold"] = load_font(font_bytes_ar_bold, 36, bold_candidates)
+
+def load_row_photo(row: tuple, photos: dict):
+    """Decode the photo for a CARD_FIELDS tuple; returns (RGB array or None, warning or None)."""
+    raw_name, photo_filename = row[0], row[5]
+    photo_data = photos.get(photo_key(photo_filename)) if photo_filename else None
+    if photo_data is None:
+        return None, f"📷 Photo not found for '{raw_name}'. Requested: {photo_filename}"
+    try:
+        return load_photo_rgb(photo_data), None
+    except Exception as e:
+        return None, f"⚠️ Failed to place photo for '{raw_name}': {e}"
+
+def build_cards(rows: list, photo_index: dict) -> list:
+    """Render a chunk of cards; photos are decoded on a prefetch thread while text is drawn.
+
+    photo_index holds only the photo bytes this chunk's rows refer to.
+    """
+    photos = queue.Queue(maxsize=PHOTO_PREFETCH)
+    stop = threading.Event()
+
+    def produce():
+        for row in rows:
+            if stop.is_set():
+                return
+            try:
+                photos.put(load_row_photo(row, photo_index))
+            except BaseException as e:  # never leave the consumer waiting
+                photos.put((None, f"⚠️ Failed to place photo for '{row[0]}': {e}"))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        return [build_card(row, photos.get()) for row in rows]
+    finally:
+        # If a card failed mid-chunk, unblock the producer so it exits instead
+        # of hanging on a full queue for the life of the worker.
+        stop.set()
+        while producer.is_alive():
+            try:
+                photos.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def build_card(row: tuple, photo: tuple):
+    """Render one card from a CARD_FIELDS tuple and its load_row_photo() result.
+
+    Returns (JPEG bytes, warning messages).
+    """
+    card = _worker["card"]
+    draw = _worker["draw"]
+    font_ar = _worker["font_ar"]
+    font_ar_bold = _worker["font_ar_bold"]
+    warnings = []
+
+    # Reset the shared canvas to the template; it is encoded before the next card starts.
+    card.paste(_worker["template"], (0, 0))
+
+    # Prepare texts
+    raw_name, name, job, num, national_id, photo_filename = row
+
+    # Draw texts (the template already is the static layer; only these vary)
+    name_xy = NAME_XY
+    draw_bold_text(draw, name_xy, name, font_ar, "black", "rt", bold_font=font_ar_bold)
+
+    name_bbox = text_bbox(name, font_ar_bold or font_ar)
+    name_height = (name_bbox[3] - name_bbox[1]) + 20
+
+    job_xy = (name_xy[0], name_xy[1] + name_height)
+    draw_aligned_text(draw, job_xy, job, font_ar, "black", "rt")
+
+    job_bbox = text_bbox(job, font_ar)
+    job_height = (job_bbox[3] - job_bbox[1]) + 25
+
+    id_xy = (name_xy[0], job_xy[1] + job_height)
+    job_id_label = prepare_text(JOB_ID_LABEL + num)
+    draw_aligned_text(draw, id_xy, job_id_label, font_ar, "black", "rt")
+
+    # Place photo
+    photo_rgb, photo_warning = photo
+    if photo_rgb is not None:
+        card.paste(Image.fromarray(photo_rgb), PHOTO_POS)
+    else:
+        warnings.append(photo_warning)
+
+    # Place barcode
+    try:
+        if national_id:
+            card.paste(render_barcode(national_id), BARCODE_POS)
+    except Exception as e:
+        warnings.append(f"⚠️ Failed to generate barcode for '{raw_name}': {e}")
+
+    # 72 dpi so img2pdf sizes pages 1 px = 1 pt, as Pillow's PDF writer did.
+    buf = io.BytesIO()
+    card.save(buf, format="JPEG", quality=85, dpi=(72, 72))
+    return buf.getvalue(), warnings
@@ -0,0 +1,15 @@
+#!/bin/sh
+# Best-effort: replace stock Pillow with an AVX2 build of Pillow-SIMD.
+#
+# Run after `pip install -r requirements.txt` on a self-hosted box with a
+# compiler and the image headers (Debian/Ubuntu: libjpeg-dev zlib1g-dev
+# libfreetype6-dev libwebp-dev). Streamlit Cloud has no post-install hook,
+# so there the app runs on the stock Pillow from requirements.txt.
+#
+# Pillow-SIMD tracks the 9.x API; the app only uses calls available there.
+# `pip check` will report streamlit's pillow requirement as unmet; the PIL
+# package it needs is provided by pillow-simd.
+set -e
+pip uninstall -y pillow pillow-simd
+CC="cc -mavx2" pip install --no-cache-dir --no-binary :all: pillow-simd
+python -c "import PIL; print('Pillow', PIL.__version__)"